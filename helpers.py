@@ -1,5 +1,4 @@
 import datetime as dt
-import math
 import shutil
 import os
 import re
@@ -17,26 +16,48 @@ def format_messages(message_list):
     return "\n".join(final_str)
 
 
+# forbidden characters retrieved from https://stackoverflow.com/questions/1976007/what-characters-are-forbidden-in-windows-and-linux-directory-names
+# hyphens converted to % as well so as to not interfere with naming scheme
+forbidden_chars_pattern = re.compile(r"[\\/:*?\"<>|\-]")
+
+
 def format_instance_name(container_id, container_name, path_backed):
-    # forbidden characters retrieved from https://stackoverflow.com/questions/1976007/what-characters-are-forbidden-in-windows-and-linux-directory-names
-    # hyphens converted to % as well so as to not interfere with naming scheme
+    path_backed_formatted = forbidden_chars_pattern.sub("%", path_backed)
+    container_name_formatted = forbidden_chars_pattern.sub("%", container_name)
+
+    return f"{container_id}-{container_name_formatted}-{path_backed_formatted}"
+
 
-    path_backed_formatted = re.sub(r"[\\/:*?\"<>|]", "%", path_backed).replace("-", "%")
-    container_name_formatted = re.sub(r"[\\/:*?\"<>|]", "%", container_name).replace(
-        "-", "%"
+def format_instance_name_series(df):
+    # Vectorized equivalent of format_instance_name over the rows of a dataframe
+    path_backed_formatted = (
+        df["path_backed"]
+        .astype(str)
+        .str.replace(forbidden_chars_pattern, "%", regex=True)
+    )
+    container_name_formatted = (
+        df["container_name"]
+        .astype(str)
+        .str.replace(forbidden_chars_pattern, "%", regex=True)
     )
 
-    return f"{container_id}-{container_name_formatted}-{path_backed_formatted}"
+    return (
+        df["container_id"].astype(str)
+        + "-"
+        + container_name_formatted
+        + "-"
+        + path_backed_formatted
+    )
 
 
 date_format_string = "%y%m%d"
 df_dtypes = {
-    "container_id": "str",
-    "container_name": "str",
-    "path_backed": "str",
+    "container_id": "category",
+    "container_name": "category",
+    "path_backed": "category",
     "container_dt_last_alive": "datetime64[ns]",
     "dt_last_backed": "datetime64[ns]",
-    "size_last_backed": "int64",
+    "size_last_backed": "Int64",
     "dt_deleted": "datetime64[ns]",
 }
 
@@ -49,11 +70,9 @@ def construct_backup_name(instance_name, date):
 
 
 def parse_to_datetime(date_string):
-    # Use regex to truncate the string to second precision
-    truncated_string = re.sub(r"(\.\d+)?Z$", "Z", date_string)
-
-    # Parse the truncated string
-    return dt.datetime.strptime(truncated_string, "%Y-%m-%dT%H:%M:%SZ")
+    # Docker timestamps are UTC, in the form YYYY-MM-DDTHH:MM:SS[.fraction]Z
+    # Truncate to second precision, which fromisoformat parses directly (unlike the nanosecond fraction and "Z")
+    return dt.datetime.fromisoformat(date_string[:19])
 
 
 def parse_filename(
@@ -96,8 +115,9 @@ def convert_bytes_to_readable(num_bytes):
         return "0 B"
 
     size_name = ["B", "KiB", "MiB", "GiB", "TiB"]
-    i = int(math.floor(math.log(num_bytes, 1024)))
-    p = math.pow(1024, i)
+    # Each unit is 2^10 times the previous, so the unit index follows from the bit length
+    i = min((int(num_bytes).bit_length() - 1) // 10, len(size_name) - 1)
+    p = 1 << (i * 10)
     s = round(num_bytes / p, 2)
     size_str = f"{s} {size_name[i]}"
 
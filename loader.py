@@ -8,7 +8,43 @@ import pandas as pd
 CONFIG_FILENAME = "config.yaml"
 BACKUPS_DIR_FILENAME = "backups"
 LOGS_DIR_FILENAME = "logs"
-INSTANCE_INFO_FILENAME = "instance_info.csv"
+INSTANCE_INFO_FILENAME = "instance_info.parquet"
+LEGACY_INSTANCE_INFO_FILENAME = "instance_info.csv"
+
+# Use the libyaml-backed loader when PyYAML was built with it
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# Validation rules for config options: (check, error message formatted with the offending type and value)
+CONFIG_RULES = {
+    "min_backup_interval": (
+        lambda v: isinstance(v, int) and v >= 0,
+        "min_backup_interval expected a non-negative integer but got {type}:{value}. 0 means that if the container is currently running, backups are made every time that the script is run.",
+    ),
+    "ghost_backup_keep_days": (
+        lambda v: isinstance(v, int) and v >= -1,
+        "ghost_backup_keep_days expected either -1 (disable ghost backup pruning) or a non-negative integer, but got {type}:{value}",
+    ),
+    "backup_keep_num": (
+        lambda v: isinstance(v, int) and (v == -1 or v > 0),
+        "backup_keep_num expected either -1 (disable old backup pruning) or a positive integer, but got {type}:{value}",
+    ),
+    "warn_large_backup_mb": (
+        lambda v: isinstance(v, int) and v >= 0,
+        "warn_large_backup_mb expected a non-negative integer, but got {type}:{value}",
+    ),
+    "backup_by_default": (
+        lambda v: isinstance(v, bool),
+        "backup_by_default expected a boolean value, but got {type}:{value}",
+    ),
+    "container_paths": (
+        lambda v: isinstance(v, dict),
+        "container_paths expected a dictionary, but got {type}:{value}",
+    ),
+    "archive_dir_path": (
+        lambda v: isinstance(v, str),
+        "archive_dir_path expected a string, but got {type}:{value}",
+    ),
+}
 
 
 def load_and_parse_args(default_config, curr_path):
@@ -20,7 +56,7 @@ def load_and_parse_args(default_config, curr_path):
         # Read from custom config and validate
         try:
             with open(config_path, "r") as file:
-                custom_config = yaml.safe_load(file)
+                custom_config = yaml.load(file, Loader=YamlLoader)
 
             if custom_config is not None:
                 for key, value in custom_config.items():
@@ -28,42 +64,16 @@ def load_and_parse_args(default_config, curr_path):
                         raise ValueError("Do not leave any parameters blank! Comment them out if you want to use default values.")
                 config = {**default_config, **custom_config}
 
-            if not (
-                isinstance(config["min_backup_interval"], int)
-                and (config["min_backup_interval"] >= 0)
-            ):
-                raise ValueError(
-                    f"min_backup_interval expected a non-negative integer but got {type(config['min_backup_interval']).__name__}:{config['min_backup_interval']}. 0 means that if the container is currently running, backups are made every time that the script is run."
-                )
-            if not (
-                isinstance(config["ghost_backup_keep_days"], int)
-                and (config["ghost_backup_keep_days"] >= -1)
-            ):
-                raise ValueError(
-                    f"ghost_backup_keep_days expected either -1 (disable ghost backup pruning) or a non-negative integer, but got {type(config['ghost_backup_keep_days']).__name__}:{config['ghost_backup_keep_days']}"
-                )
-            if not (
-                isinstance(config["backup_keep_num"], int)
-                and (config["backup_keep_num"] == -1 or config["backup_keep_num"] > 0)
-            ):
-                raise ValueError(
-                    f"backup_keep_num expected either -1 (disable old backup pruning) or a positive integer, but got {type(config['backup_keep_num']).__name__}:{config['backup_keep_num']}"
-                )
-            if not (
-                isinstance(config["warn_large_backup_mb"], int)
-                and (config["warn_large_backup_mb"] >= 0)
-            ):
-                raise ValueError(
-                    f"warn_large_backup_mb expected a non-negative integer, but got {type(config['warn_large_backup_mb']).__name__}:{config['warn_large_backup_mb']}"
-                )
-            if not isinstance(config["backup_by_default"], bool):
-                raise ValueError(
-                    f"backup_by_default expected a boolean value, but got {type(config['backup_by_default']).__name__}:{config['backup_by_default']}"
-                )
-            if not isinstance(config["container_paths"], dict):
-                raise ValueError(
-                    f"container_paths expected a dictionary, but got {type(config['container_paths']).__name__}:{config['container_paths']}"
-                )
+            # Only user-supplied values are validated, defaults (eg. infinite keep values) are trusted
+            for key, value in (custom_config or {}).items():
+                if key not in CONFIG_RULES:
+                    continue
+                is_valid, error_message = CONFIG_RULES[key]
+                if not is_valid(value):
+                    raise ValueError(
+                        error_message.format(type=type(value).__name__, value=value)
+                    )
+
             for container_id, paths in config["container_paths"].items():
                 if not (isinstance(container_id, str) or container_id.is_numeric()):
                     raise ValueError(
@@ -82,10 +92,6 @@ def load_and_parse_args(default_config, curr_path):
                         raise ValueError(
                             f"Error for container {container_id}: Expected a string path, but got {type(path).__name__}:{path}"
                         )
-            if not isinstance(config["archive_dir_path"], str):
-                raise ValueError(
-                    f"archive_dir_path expected a string, but got {type(config['archive_dir_path']).__name__}:{config['archive_dir_path']}"
-                )
 
         except yaml.YAMLError as e:
             print(f"Error parsing YAML in {config_path}: {e}")
@@ -140,23 +146,39 @@ def load_and_parse_args(default_config, curr_path):
     instance_info_path = os.path.join(
         config["archive_dir_path"], INSTANCE_INFO_FILENAME
     )
+    legacy_instance_info_path = os.path.join(
+        config["archive_dir_path"], LEGACY_INSTANCE_INFO_FILENAME
+    )
     if os.path.exists(instance_info_path):
+        try:
+            df = pd.read_parquet(instance_info_path)
+            logger.info(
+                f"Found {len(df)} instances to track from {instance_info_path}."
+            )
+        except:
+            logger.error(f"Error reading from {instance_info_path}!")
+            raise
+    elif os.path.exists(legacy_instance_info_path):
+        # One-time migration from the CSV format used by earlier versions
         try:
             df = pd.read_csv(
-                instance_info_path,
+                legacy_instance_info_path,
+                dtype={
+                    c: t
+                    for c, t in helpers.df_dtypes.items()
+                    if not t.startswith("datetime64")
+                },
                 parse_dates=["container_dt_last_alive", "dt_last_backed", "dt_deleted"],
-                date_format="%Y-%m-%d %H:%M:%S",
+                date_format="ISO8601",
+                cache_dates=True,
             )
-            df["container_dt_last_alive"] = pd.to_datetime(
-                df["container_dt_last_alive"]
-            )
-            df["dt_last_backed"] = pd.to_datetime(df["dt_last_backed"])
-            df["dt_deleted"] = pd.to_datetime(df["dt_deleted"])
+            # parse_dates leaves the columns of a header-only file as object
+            df = df.astype(helpers.df_dtypes)
             logger.info(
-                f"Found {len(df)} instances to track from {instance_info_path}."
+                f"Found {len(df)} instances to track from {legacy_instance_info_path}, migrating to {instance_info_path}..."
             )
         except:
-            logger.error(f"Error reading from {instance_info_path}!")
+            logger.error(f"Error reading from {legacy_instance_info_path}!")
             raise
     else:
         logger.info(
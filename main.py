@@ -1,17 +1,14 @@
 import os
-import telegram
-from telegram.constants import ParseMode
 import datetime as dt
 import traceback
 import custom_logging
-import asyncio
 import helpers
-import docker
 import loader
 import workflows
 
 # Constants
 curr_path = os.path.dirname(__file__)
+TELEGRAM_TIMEOUT_SECONDS = 10
 
 # Default backup settings
 default_config = {
@@ -27,7 +24,31 @@ default_config = {
 }
 
 
-async def main(df, bot):
+def send_telegram_message(text):
+    # The HTTP client is only needed when notifications are configured
+    import httpx
+
+    try:
+        response = httpx.post(
+            f"https://api.telegram.org/bot{config['telegram_bot_token']}/sendMessage",
+            json={
+                "chat_id": config["telegram_chat_id"],
+                "text": text,
+                "parse_mode": "HTML",
+            },
+            timeout=TELEGRAM_TIMEOUT_SECONDS,
+        )
+        response.raise_for_status()
+    # The request URL contains the bot token, so neither the exception nor its traceback is logged
+    except httpx.HTTPStatusError as e:
+        logger.error(
+            f"Cannot send Telegram message: {e.response.status_code} {e.response.reason_phrase}"
+        )
+    except httpx.HTTPError as e:
+        logger.error(f"Cannot send Telegram message: {type(e).__name__}")
+
+
+def main(df, notify):
     total_prune_size = 0
     total_backup_size = 0
 
@@ -38,16 +59,14 @@ async def main(df, bot):
         f"Remaining disk space: {free_percent}%, {free_str}"
     )
     logger.info(message)
-    if bot:
-        await bot.send_message(
-            text=message,
-            chat_id=config["telegram_chat_id"],
-            parse_mode=ParseMode.HTML,
-        )
+    if notify:
+        send_telegram_message(message)
 
     # Get docker client
     docker_client = None
     try:
+        import docker
+
         docker_client = docker.from_env().api
         logger.info("Docker client loaded!")
     except:
@@ -58,7 +77,7 @@ async def main(df, bot):
     if docker_client:
         try:
             df = workflows.update_instances(
-                df.copy(),
+                df,
                 docker_client,
                 config["container_paths"],
                 config["backup_by_default"]
@@ -70,28 +89,40 @@ async def main(df, bot):
             logger.error(traceback.format_exc())
             df = None
 
-    # Prune backups of instances that are marked as deleted
+    # Index existing backups by instance name once, for use by both pruning steps
+    backups_by_instance = None
     try:
-        df, prune_size = workflows.prune_ghost_backups(
-            df.copy(), backup_dir_path, config["ghost_backup_keep_days"]
-        )
-        total_prune_size += prune_size
+        backups_by_instance = workflows.index_backups(backup_dir_path)
     except:
-        logger.warning("Error while pruning ghost backups!")
-        logger.warning(traceback.format_exc())
+        logger.error(
+            "Error while reading existing backups! Stopping pruning and backup actions for safety reasons..."
+        )
+        logger.error(traceback.format_exc())
+
+    # Prune backups of instances that are marked as deleted
+    if backups_by_instance is not None:
+        try:
+            df, prune_size = workflows.prune_ghost_backups(
+                df, config["ghost_backup_keep_days"], backups_by_instance
+            )
+            total_prune_size += prune_size
+        except:
+            logger.warning("Error while pruning ghost backups!")
+            logger.warning(traceback.format_exc())
 
     # If docker client is available, backup tracked instances (that are not marked as deleted)
-    if docker_client:
+    if docker_client and backups_by_instance is not None:
         # Find the instances that require backup, prune extra backups for each instance if necessary, then create backups
         try:
             df, prune_size, total_backup_size = (
                 workflows.prune_extra_and_create_backups(
-                    df.copy(),
+                    df,
                     docker_client,
                     backup_dir_path,
                     config["min_backup_interval"],
                     config["backup_keep_num"],
-                    config["warn_large_backup_mb"]
+                    config["warn_large_backup_mb"],
+                    backups_by_instance,
                 )
             )
             total_prune_size += prune_size
@@ -100,7 +131,7 @@ async def main(df, bot):
             logger.error(traceback.format_exc())
 
     # Save instance information to disk
-    df.to_csv(instance_info_path, index=False)
+    df.to_parquet(instance_info_path, compression="zstd", index=False)
 
     # Compile alert messages
     error_message = []
@@ -136,17 +167,8 @@ async def main(df, bot):
         f"Pruned: {helpers.convert_bytes_to_readable(total_prune_size)}, Created: {helpers.convert_bytes_to_readable(total_backup_size)}\n"
         f"Remaining disk space: {free_percent}%, {free_str}"
     )
-    if bot:
-        await bot.send_message(
-            text=final_str,
-            chat_id=config["telegram_chat_id"],
-            parse_mode=ParseMode.HTML,
-        )
-
-
-async def main_bot_wrapped(df, bot):
-    async with bot:
-        await main(df, bot)
+    if notify:
+        send_telegram_message(final_str)
 
 
 if __name__ == "__main__":
@@ -157,11 +179,10 @@ if __name__ == "__main__":
     logger, logLevelCountHandler = custom_logging.get_logger(__name__)
 
     if config["telegram_chat_id"] and config["telegram_bot_token"]:
-        bot = telegram.Bot(config["telegram_bot_token"])
-        logger.info("Connected to Telegram!")
-        asyncio.run(main_bot_wrapped(df, bot))
+        logger.info("Sending notifications via Telegram!")
+        main(df, True)
 
     else:
-        asyncio.run(main(df, None))
+        main(df, False)
 
     logger.info("Gracefully exiting...")
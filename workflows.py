@@ -1,38 +1,33 @@
 import os
+import gzip
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 import helpers
 import pandas as pd
+from pandas.api.types import union_categoricals
 import custom_logging
 import traceback
 import numpy as np
 
 logger, _ = custom_logging.get_logger(__name__)
 
-
-def update_dt_deleted(row, instances_to_backup, dt_current):
-    # If the instance is to be backed up, set the delete time to NaT
-    # - possible for an instance marked as deleted to be un-deleted (ie. dt_deleted reset to NaT)
-    # Else set the delete time to the current time
-    if (
-        row["container_id"] in instances_to_backup
-        and row["path_backed"] in instances_to_backup[row["container_id"]]
-    ):
-        return pd.NaT
-    elif pd.isna(row["dt_deleted"]):
-        return dt_current
-    return row["dt_deleted"]
+ALIVE_CONTAINER_STATES = {"running", "paused"}
+BACKUP_WRITE_BUFFER_SIZE = 4 * 1024**2
+BACKUP_COMPRESS_LEVEL = 1
+MAX_CONCURRENT_BACKUPS = 4
+# Matches the docker SDK's default connection pool size
+MAX_CONCURRENT_INSPECTIONS = 10
 
 
-def update_dt_last_alive(row, containers_dt_last_alive):
-    if row["container_id"] in containers_dt_last_alive:
-        return containers_dt_last_alive[row["container_id"]]
-    else:
-        return row["container_dt_last_alive"]
-
-
-def get_container_dt_last_alive(container_id, dt_current, client):
+def get_container_dt_last_alive(container, dt_current, client):
     # We consider a container's last alive time to be the current time if it is still running,
     # or the time it finished if it has stopped
-    inspection = client.inspect_container(container_id)
+    # - the state reported by containers(all=True) is enough to tell if it is still running,
+    #   so only stopped containers need a separate inspection round-trip for their finish time
+    if container.get("State") in ALIVE_CONTAINER_STATES:
+        return dt_current
+
+    inspection = client.inspect_container(container["Id"])
     dt_started_at = helpers.parse_to_datetime(inspection["State"]["StartedAt"])
     dt_finished_at = helpers.parse_to_datetime(inspection["State"]["FinishedAt"])
 
@@ -42,17 +37,12 @@ def get_container_dt_last_alive(container_id, dt_current, client):
 
 
 def update_instances(df, docker_client, container_paths, backup_by_default):
+    dt_current = helpers.get_current_datetime()
     instances_to_backup = {}
-    new_rows = []
+    # Columns of new instances, the rest of which start out empty
+    new_rows = {"container_id": [], "container_name": [], "path_backed": []}
     # Get names of instances from dataframe
-    current_instance_names = set(
-        df.apply(
-            lambda row: helpers.format_instance_name(
-                row["container_id"], row["container_name"], row["path_backed"]
-            ),
-            axis=1,
-        )
-    )
+    current_instance_names = set(helpers.format_instance_name_series(df))
     # Get shortened container IDs from config
     container_paths = {
         container_id[:12]: paths for container_id, paths in container_paths.items()
@@ -79,32 +69,57 @@ def update_instances(df, docker_client, container_paths, backup_by_default):
         for path in instances_to_backup[short_id]:
             instance_name = helpers.format_instance_name(short_id, container_name, path)
             if instance_name not in current_instance_names:
-                new_rows.append(
-                    {
-                        "container_id": short_id,
-                        "container_name": container_name,
-                        "path_backed": path,
-                        "container_dt_last_alive": pd.NaT,
-                        "dt_last_backed": pd.NaT,
-                        "size_last_backed": np.nan,
-                        "dt_deleted": pd.NaT,
-                    }
-                )
+                # Track the new name too, so that a path repeated in the config is only added once
+                current_instance_names.add(instance_name)
+                new_rows["container_id"].append(short_id)
+                new_rows["container_name"].append(container_name)
+                new_rows["path_backed"].append(path)
     # Actually append data of new instances to dataframe
-    if len(new_rows):
-        df = pd.concat(
-            [df, pd.DataFrame(new_rows, columns=df.columns)],
-            ignore_index=True,
+    new_rows_count = len(new_rows["container_id"])
+    if new_rows_count:
+        # - each column is built directly in its schema dtype, so that no dtype inference or re-casting is needed
+        # - an empty dataframe is not concatenated at all, as pandas is deprecating how empty entries affect dtypes
+        new_df = pd.DataFrame(
+            {
+                column: pd.array(
+                    new_rows.get(column, [None] * new_rows_count), dtype=dtype
+                )
+                for column, dtype in helpers.df_dtypes.items()
+            }
         )
+        if len(df):
+            # Concatenating categoricals with differing categories falls back to object,
+            # so both sides are first given the union of their categories
+            shared_dtypes = {
+                column: (
+                    union_categoricals([df[column], new_df[column]]).dtype
+                    if dtype == "category"
+                    else dtype
+                )
+                for column, dtype in helpers.df_dtypes.items()
+            }
+            df = pd.concat(
+                [df.astype(shared_dtypes), new_df.astype(shared_dtypes)],
+                ignore_index=True,
+                copy=False,
+            )
+        else:
+            df = new_df
 
     # Update date_deleted column based on instances_to_backup
     initial_len = df["dt_deleted"].notna().sum()
-    df["dt_deleted"] = df.apply(
-        update_dt_deleted,
-        axis=1,
-        instances_to_backup=instances_to_backup,
-        dt_current=helpers.get_current_datetime(),
+    # If the instance is to be backed up, set the delete time to NaT
+    # - possible for an instance marked as deleted to be un-deleted (ie. dt_deleted reset to NaT)
+    # Else set the delete time to the current time, if not already marked as deleted
+    live_pairs = frozenset(
+        (container_id, path)
+        for container_id, paths in instances_to_backup.items()
+        for path in paths
     )
+    to_backup_mask = pd.MultiIndex.from_arrays(
+        [df["container_id"], df["path_backed"]]
+    ).isin(live_pairs)
+    df["dt_deleted"] = df["dt_deleted"].fillna(dt_current).mask(to_backup_mask, pd.NaT)
     final_len = df["dt_deleted"].notna().sum()
     if initial_len == final_len:
         logger.info(f"No. of instances to be backed up: {final_len}")
@@ -113,65 +128,85 @@ def update_instances(df, docker_client, container_paths, backup_by_default):
             f"No. of instances to be backed up has changed from: {initial_len} --> {final_len}"
         )
     # Update container_dt_last_alive column for all containers
-    containers_dt_last_alive = {
-        helpers.short(container["Id"]): get_container_dt_last_alive(
-            container["Id"], helpers.get_current_datetime(), docker_client
+    # - inspections are blocking round-trips to the docker daemon, so they are made concurrently
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_INSPECTIONS) as executor:
+        containers_dt_last_alive = dict(
+            zip(
+                [helpers.short(container["Id"]) for container in container_list],
+                executor.map(
+                    lambda container: get_container_dt_last_alive(
+                        container, dt_current, docker_client
+                    ),
+                    container_list,
+                ),
+            )
         )
-        for container in container_list
-    }
-    df["container_dt_last_alive"] = df.apply(
-        update_dt_last_alive, containers_dt_last_alive=containers_dt_last_alive, axis=1
+    # - containers that no longer exist keep their previous last alive time
+    # - map on a categorical column is not guaranteed to return datetimes (eg. when empty), hence the astype
+    df["container_dt_last_alive"] = (
+        df["container_id"]
+        .map(containers_dt_last_alive)
+        .astype("datetime64[ns]")
+        .fillna(df["container_dt_last_alive"])
     )
 
     return df
 
 
-def prune_ghost_backups(df, backup_dir_path, ghost_backup_keep_days):
+def index_backups(backup_dir_path):
+    # Group existing backups by their instance name, so that each instance's backups can be looked up directly
+    # - paths and sizes are taken from the directory scan, so pruning does not need to join or stat them again
+    backups_by_instance = defaultdict(list)
+    with os.scandir(backup_dir_path) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            instance_name, backup_date = helpers.parse_filename(entry.name)
+            backups_by_instance[instance_name].append(
+                (entry.name, backup_date, entry.stat().st_size, entry.path)
+            )
+
+    return backups_by_instance
+
+
+def prune_ghost_backups(df, ghost_backup_keep_days, backups_by_instance):
     total_prune_size = 0
 
-    backup_filenames = os.listdir(backup_dir_path)
+    # Ghost backups are never pruned by default, in which case there is nothing to check
+    if ghost_backup_keep_days == float("inf"):
+        logger.info("Pruning of ghost backups is disabled.")
+        return df, total_prune_size
 
     # Get instances where it has been at least more than ghost_backup_keep_days days since it was marked as deleted
-    deleted_df = df[(df["dt_deleted"].notna())]
-    instances_to_prune = deleted_df[
-        (helpers.get_current_datetime() - deleted_df["dt_deleted"]).dt.days
-        >= ghost_backup_keep_days
+    # - rows not marked as deleted have a NaT age, which never satisfies the comparison
+    time_since_deleted = helpers.get_current_datetime() - df["dt_deleted"]
+    instances_to_prune = df[
+        time_since_deleted >= pd.Timedelta(days=ghost_backup_keep_days)
     ]
     logger.info(f"Backups of {len(instances_to_prune)} ghost instances to be pruned.")
 
     if not len(instances_to_prune):
         return df, total_prune_size
 
-    instance_names = instances_to_prune.apply(
-        lambda row: helpers.format_instance_name(
-            row["container_id"], row["container_name"], row["path_backed"]
-        ),
-        axis=1,
-    )
+    instance_names = helpers.format_instance_name_series(instances_to_prune)
     labels = instances_to_prune.index
-    parsed_filename_list = [
-        (filename, helpers.parse_filename(filename)[0]) for filename in backup_filenames
-    ]
 
     pruned_instance_label_list = []
-    for instance_name_to_prune, label in zip(instance_names, labels):
+    for instance_name_to_prune, label in zip(
+        instance_names.to_numpy(), labels.to_numpy()
+    ):
         # Filter list of backups for the current iteration's instance
-        filenames = [
-            filename
-            for filename, instance_name in parsed_filename_list
-            if instance_name == instance_name_to_prune
-        ]
-        if not len(filenames):
+        backups = backups_by_instance.get(instance_name_to_prune, [])
+        if not len(backups):
             logger.warning(f"Cannot find backups for {instance_name_to_prune}.")
             continue
 
         # Delete found backups
         pruned_backups_count = 0
-        for filename in filenames:
+        for filename, _, filesize, backup_path in backups:
             logger.info(f"Pruning backup: {filename}...")
-            filesize = os.path.getsize(os.path.join(backup_dir_path, filename))
             try:
-                os.remove(os.path.join(backup_dir_path, filename))
+                os.remove(backup_path)
                 pruned_backups_count += 1
                 total_prune_size += filesize
             except:
@@ -179,8 +214,9 @@ def prune_ghost_backups(df, backup_dir_path, ghost_backup_keep_days):
                 logger.warning(traceback.format_exc())
 
         # Only drop instance when all its corresponding backups are pruned
-        if pruned_backups_count == len(filenames):
+        if pruned_backups_count == len(backups):
             pruned_instance_label_list.append(label)
+            del backups_by_instance[instance_name_to_prune]
     logger.info(
         f"{len(pruned_instance_label_list)} out of {len(instance_names)} instances successfully pruned!"
     )
@@ -195,125 +231,160 @@ def prune_extra_and_create_backups(
     backup_dir_path,
     min_backup_interval,
     backup_keep_num,
-    warn_large_backup_mb
+    warn_large_backup_mb,
+    backups_by_instance,
 ):
     total_prune_size = 0
     total_backup_size = 0
-
-    backup_filenames = os.listdir(backup_dir_path)
-    parsed_filename_list = [
-        (filename, helpers.parse_filename(filename)) for filename in backup_filenames
-    ]
+    # A single snapshot of the current time is used for selecting instances and for timestamping all their backups
+    dt_current = helpers.get_current_datetime()
 
     # Instance must be
     # - not marked as deleted
     # - either not backed up yet OR
     # - undergone changes since its last backup date AND backed up at least min_backup_interval days ago
+    # - evaluated on the underlying datetime64 arrays, where comparisons against NaT are always False
+    dt_deleted = df["dt_deleted"].to_numpy()
+    dt_last_backed = df["dt_last_backed"].to_numpy()
+    container_dt_last_alive = df["container_dt_last_alive"].to_numpy()
     df_instances_to_backup = df[
-        df["dt_deleted"].isna()
+        np.isnat(dt_deleted)
         & (
-            df["dt_last_backed"].isna()
+            np.isnat(dt_last_backed)
             | (
-                (df["container_dt_last_alive"] > df["dt_last_backed"])
+                (container_dt_last_alive > dt_last_backed)
                 & (
-                    (helpers.get_current_datetime() - df["dt_last_backed"]).dt.days
-                    >= min_backup_interval
+                    np.datetime64(dt_current) - dt_last_backed
+                    >= np.timedelta64(min_backup_interval, "D")
                 )
             )
         )
     ]
 
-    containers_to_backup = set(df_instances_to_backup["container_id"].tolist())
+    # Map each instance name to its row position once, instead of searching the dataframe per backup
+    name_to_position = {}
+    duplicate_names = set()
+    for position, name in enumerate(helpers.format_instance_name_series(df)):
+        if name in name_to_position:
+            duplicate_names.add(name)
+        name_to_position[name] = position
+    containers_to_backup_count = df_instances_to_backup["container_id"].nunique()
     logger.info(
-        f"{len(df_instances_to_backup)} instance(s) from {len(containers_to_backup)} container(s) require backup."
+        f"{len(df_instances_to_backup)} instance(s) from {containers_to_backup_count} container(s) require backup."
     )
 
-    for row in df_instances_to_backup.itertuples():
-        short_id, container_name, container_path = (
-            row.container_id,
-            row.container_name,
-            row.path_backed,
-        )
-        instance_name = helpers.format_instance_name(
-            short_id, container_name, container_path
-        )
-        instance_prune_size = 0
-        instance_prune_count = 0
-
-        backups = [
-            (filename, backup_date)
-            for filename, (
-                backup_instance_name,
-                backup_date,
-            ) in parsed_filename_list
-            if backup_instance_name == instance_name
-        ]
-
-        # Count existing backups to see if pruning is required
-        if len(backups) >= backup_keep_num:
-            logger.info(
-                f"{instance_name} has {len(backups)}/{backup_keep_num} backups..."
+    # Backups are I/O-bound on both the docker daemon and the disk, so instances are backed up concurrently
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_BACKUPS) as executor:
+        futures = []
+        for row in df_instances_to_backup.itertuples():
+            instance_name = helpers.format_instance_name(
+                row.container_id, row.container_name, row.path_backed
+            )
+            futures.append(
+                executor.submit(
+                    backup_instance,
+                    client,
+                    backup_dir_path,
+                    row.container_id,
+                    row.path_backed,
+                    instance_name,
+                    list(backups_by_instance.get(instance_name, [])),
+                    backup_keep_num,
+                    warn_large_backup_mb,
+                    dt_current,
+                )
             )
 
-            # Prune oldest first, until number of backups is one less than backup_keep_num
-            backups.sort(key=lambda x: x[1])
-            for i in range(len(backups) - backup_keep_num + 1):
-                filename = backups[i][0]
-                logger.info(f"Pruning backup: {filename}...")
-                filesize = os.path.getsize(os.path.join(backup_dir_path, filename))
-                try:
-                    os.remove(os.path.join(backup_dir_path, filename))
-                    total_prune_size += filesize
-                    instance_prune_size += filesize
-                    instance_prune_count += 1
-                except:
-                    logger.warning(f"Cannot prune backup: {filename}!")
-                    logger.warning(traceback.format_exc())
-
-        # Create backup of instance
-        dt_backed = helpers.get_current_datetime()
-        backup_name = helpers.construct_backup_name(instance_name, dt_backed)
-        logger.info(f"Creating backup: {backup_name}...")
-        try:
-            bits, _ = client.get_archive(short_id, container_path, encode_stream=True)
-            with open(f"{os.path.join(backup_dir_path, backup_name)}.gz", "wb") as file:
-                for chunk in bits:
-                    file.write(chunk)
-            filesize = os.path.getsize(
-                f"{os.path.join(backup_dir_path, backup_name)}.gz"
+    # Update dt_last_backed and size_last_backed only once all backups are done, as pandas is not thread-safe
+    dt_last_backed_position = df.columns.get_loc("dt_last_backed")
+    size_last_backed_position = df.columns.get_loc("size_last_backed")
+    for future in futures:
+        instance_name, instance_prune_size, dt_backed, filesize = future.result()
+        total_prune_size += instance_prune_size
+        if filesize is None:
+            continue
+
+        total_backup_size += filesize
+        if instance_name in duplicate_names:
+            logger.warning(
+                f"Multiple rows with the same instance name found, not updating: {instance_name}!"
             )
-            total_backup_size += filesize
-            logger.info(
-                f"Backup created: {helpers.convert_bytes_to_readable(filesize)}"
+            continue
+        if instance_name not in name_to_position:
+            logger.warning(
+                f"No row with the instance name found, not updating: {instance_name}!"
             )
+            continue
+        position_to_update = name_to_position[instance_name]
+        df.iat[position_to_update, dt_last_backed_position] = dt_backed
+        df.iat[position_to_update, size_last_backed_position] = filesize
 
-            # Update dt_last_backed and size_last_backed
-            label_to_update = df[
-                df.apply(
-                    lambda row: helpers.format_instance_name(
-                        row["container_id"],
-                        row["container_name"],
-                        row["path_backed"],
-                    ),
-                    axis=1,
-                )
-                == instance_name
-            ].index
-            assert (
-                len(label_to_update) == 1
-            ), "Multiple rows with the same instance name found!"
-            label_to_update = label_to_update[0]
-            df.loc[label_to_update, "dt_last_backed"] = dt_backed
-            df.loc[label_to_update, "size_last_backed"] = filesize
-
-            # Check if size difference between pruned and created is more than warn_large_backup_mb
-            if filesize - instance_prune_size > warn_large_backup_mb * (1024**2):
-                logger.warning(
-                    f"Large backup of {instance_name} detected! Pruned {instance_prune_count} backups: {helpers.convert_bytes_to_readable(instance_prune_size)}, Created: {helpers.convert_bytes_to_readable(filesize)}"
-                )
+    return df, total_prune_size, total_backup_size
 
-        except:
-            logger.warning(f"Error during backup creation: {backup_name}!")
-            logger.warning(traceback.format_exc())
 
-    return df, total_prune_size, total_backup_size
+def backup_instance(
+    client,
+    backup_dir_path,
+    short_id,
+    container_path,
+    instance_name,
+    backups,
+    backup_keep_num,
+    warn_large_backup_mb,
+    dt_backed,
+):
+    instance_prune_size = 0
+    instance_prune_count = 0
+
+    # Count existing backups to see if pruning is required
+    if len(backups) >= backup_keep_num:
+        logger.info(f"{instance_name} has {len(backups)}/{backup_keep_num} backups...")
+
+        # Prune oldest first, until number of backups is one less than backup_keep_num
+        backups.sort(key=lambda x: x[1])
+        for i in range(len(backups) - backup_keep_num + 1):
+            filename, _, filesize, backup_path = backups[i]
+            logger.info(f"Pruning backup: {filename}...")
+            try:
+                os.remove(backup_path)
+                instance_prune_size += filesize
+                instance_prune_count += 1
+            except:
+                logger.warning(f"Cannot prune backup: {filename}!")
+                logger.warning(traceback.format_exc())
+
+    # Create backup of instance
+    backup_name = helpers.construct_backup_name(instance_name, dt_backed)
+    logger.info(f"Creating backup: {backup_name}...")
+    try:
+        # The SDK already inflates any Content-Encoding the daemon applies, so the stream is always a plain tar
+        bits, _ = client.get_archive(short_id, container_path, encode_stream=False)
+        with open(
+            f"{os.path.join(backup_dir_path, backup_name)}.gz",
+            "wb",
+            buffering=BACKUP_WRITE_BUFFER_SIZE,
+        ) as file:
+            with gzip.GzipFile(
+                fileobj=file, mode="wb", compresslevel=BACKUP_COMPRESS_LEVEL
+            ) as output:
+                write = output.write
+                for chunk in bits:
+                    write(chunk)
+            # Size of what was written, without stat-ing the file afterwards
+            filesize = file.tell()
+        logger.info(
+            f"Backup created ({backup_name}): {helpers.convert_bytes_to_readable(filesize)}"
+        )
+
+        # Check if size difference between pruned and created is more than warn_large_backup_mb
+        if filesize - instance_prune_size > warn_large_backup_mb * (1024**2):
+            logger.warning(
+                f"Large backup of {instance_name} detected! Pruned {instance_prune_count} backups: {helpers.convert_bytes_to_readable(instance_prune_size)}, Created: {helpers.convert_bytes_to_readable(filesize)}"
+            )
+
+    except:
+        logger.warning(f"Error during backup creation: {backup_name}!")
+        logger.warning(traceback.format_exc())
+        filesize = None
+
+    return instance_name, instance_prune_size, dt_backed, filesize